@@ -1,11 +1,23 @@
 # It sets up authentication using JWT tokens from Keycloak and protects all agent endpoints
 
 import os
+import asyncio
+import base64
+import hashlib
+import re
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping
 import httpx
+import orjson
+from cachetools import TTLCache
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import JSONResponse
-from jose import jwt  # Library for handling JWT (JSON Web Tokens)
-from google.adk.cli.fast_api import get_fast_api_app
+import jwt  # PyJWT - library for handling JWT (JSON Web Tokens), uses OpenSSL via cryptography
 
 import sys
 import os
@@ -17,71 +29,426 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'wayfarer'))
 REALM_URL = os.getenv("KC_REALM_URL", "http://localhost:8080/realms/master")  # Where Keycloak is running
 # AUDIENCE  = os.getenv("KC_AUDIENCE", "adk-client")   # The client ID that tokens must be issued for
 AUDIENCE  = os.getenv("KC_AUDIENCE", "account")   # The client ID that tokens must be issued for
+# Optional file where workers share Keycloak's keys, so only one worker fetches them on startup
+# (leave unset to have every worker fetch for itself; use a directory only this service can write to)
+JWKS_CACHE_FILE = os.getenv("JWKS_CACHE_FILE")
+
+def _b64url_to_int(value: str) -> int:
+    """
+    Helper function that decodes a base64url-encoded big number from a JWK (like 'n' or 'e').
+    """
+    return int.from_bytes(base64.urlsafe_b64decode(value + "=="), "big")
+
+def _load_public_keys(jwks: dict) -> dict[str, RSAPublicKey]:
+    """
+    Helper function that turns Keycloak's JSON key set into ready-to-use public keys.
+    Each JWT token has a 'kid' (key ID) in its header that tells us which public key to use,
+    so we index the keys by their 'kid'. Doing this once up front means requests never
+    have to re-parse the JSON keys.
+    """
+    keys: dict[str, RSAPublicKey] = {}
+    for k in jwks.get("keys", []):
+        if not isinstance(k, dict):
+            continue
+        # Only RSA signing keys are useful for verifying tokens (Keycloak also publishes encryption keys)
+        if k.get("kty") != "RSA" or k.get("use", "sig") != "sig" or not k.get("kid"):
+            continue
+        keys[k["kid"]] = rsa.RSAPublicNumbers(_b64url_to_int(k["e"]), _b64url_to_int(k["n"])).public_key()
+    return keys
+
+# ---- Public Key Cache (with key rotation support) ----
+# Keycloak rotates its signing keys from time to time. When it does, new tokens arrive
+# with a 'kid' we haven't seen yet, so we fetch the key set again - but we never
+# go to Keycloak on every request, only on an unknown 'kid' and on a slow background timer.
+JWKS_MIN_REFRESH_INTERVAL = 10       # Seconds to wait between refetches triggered by an unknown 'kid'
+JWKS_DEFAULT_MAX_AGE      = 60 * 60  # Seconds to keep the keys when Keycloak doesn't say (Cache-Control: max-age)
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)", re.IGNORECASE)  # Directive names are case-insensitive
+# What a failed refresh can raise: network/HTTP errors, or a body that isn't a usable key set
+# (e.g. an HTML error page, or a key missing 'n'/'e'). Either way we keep the keys we have.
+_JWKS_REFRESH_ERRORS = (httpx.HTTPError, ValueError, KeyError, TypeError)
+
+class JWKSCache:
+    """
+    Keeps Keycloak's public keys in memory, indexed by 'kid', and refetches them
+    when a token shows up signed with a key we don't know yet.
+    """
+
+    def __init__(self):
+        self.jwks_uri = None             # Where Keycloak publishes its keys (known after startup)
+        self.keys: dict[str, RSAPublicKey] = {}
+        self.last_refresh = 0.0          # When we last tried to fetch the keys
+        self.refresh_after = 0.0         # When Keycloak says our copy of the keys gets stale
+        self.etag = None                 # Version tag of our copy, lets Keycloak answer "not modified"
+        self._lock = asyncio.Lock()      # Makes sure only one fetch runs at a time
+
+    async def load(self, client: httpx.AsyncClient):
+        """
+        Loads the keys for the first time when the app starts. Safe to call more than once:
+        only the first call actually loads anything.
+        """
+        async with self._lock:
+            if self.jwks_uri is not None:
+                return
+            config = await _load_security_config(client)
+            self.keys = _load_public_keys(config["jwks"])
+            self.jwks_uri = config["jwks_uri"]
+            self.last_refresh = time.time()
+            self._apply_cache_headers(config.get("cache_control"), config.get("etag"))
+
+    def _apply_cache_headers(self, cache_control, etag):
+        # Keycloak's Cache-Control header tells us how long its keys stay valid
+        match = _MAX_AGE_RE.search(cache_control or "")
+        max_age = int(match.group(1)) if match else JWKS_DEFAULT_MAX_AGE
+        self.refresh_after = time.time() + max_age
+        if etag:
+            self.etag = etag
+
+    async def _fetch(self, client: httpx.AsyncClient):
+        # Record the attempt first, so a Keycloak outage doesn't turn every request into a refetch
+        self.last_refresh = time.time()
+        # Ask Keycloak to only send the keys if they changed since our copy
+        headers = {"If-None-Match": self.etag} if self.etag else None
+        resp = await client.get(self.jwks_uri, headers=headers)
+        if resp.status_code != 304:  # 304 Not Modified - our keys are still current
+            resp.raise_for_status()
+            jwks = resp.json()
+            if not isinstance(jwks, dict):
+                raise ValueError("JWKS response is not a JSON object")
+            # Parse every key before swapping, so a bad response never replaces good keys
+            keys = _load_public_keys(jwks)
+            self.keys = keys
+        self._apply_cache_headers(resp.headers.get("cache-control"), resp.headers.get("etag"))
+
+    async def refresh(self, client: httpx.AsyncClient):
+        """
+        Fetches the latest keys from Keycloak, replacing the ones we have.
+        """
+        async with self._lock:
+            await self._fetch(client)
+
+    async def get_key(self, kid: str, client: httpx.AsyncClient):
+        """
+        Returns the public key for a 'kid', refetching the key set once if we don't know it.
+        Returns None if the key is still unknown after that.
+        """
+        key = self.keys.get(kid)
+        if key is not None:
+            return key
+
+        async with self._lock:
+            # Another request may have already refreshed the keys while we were waiting
+            key = self.keys.get(kid)
+            if key is None and time.time() - self.last_refresh > JWKS_MIN_REFRESH_INTERVAL:
+                try:
+                    await self._fetch(client)
+                except _JWKS_REFRESH_ERRORS as e:
+                    print(f"Failed to refresh Keycloak keys: {e!r}")
+                key = self.keys.get(kid)
+        return key
+
+jwks_cache = JWKSCache()
 
 # ---- Fetch Keycloak Security Information on Startup ----
 # When the app starts, we need to get Keycloak's public keys to verify JWT tokens
 # OIDC = OpenID Connect (a standard for authentication)
 # JWKS = JSON Web Key Set (contains the public keys for verifying token signatures)
-print("Fetching security configuration from Keycloak...")
-with httpx.Client(timeout=5.0) as c:
+# When several workers start at once, JWKS_CACHE_FILE lets just one of them ask Keycloak
+# while the others wait for it to write the result to the shared file.
+JWKS_CACHE_FILE_MAX_AGE = 60  # Seconds a shared key file is fresh enough to skip fetching
+JWKS_CACHE_LOCK_TIMEOUT = 10  # Seconds to wait for another worker before fetching ourselves
+
+async def _fetch_security_config(client: httpx.AsyncClient) -> dict:
+    """
+    Asks Keycloak where its keys live, then fetches the keys themselves.
+    """
+    print("Fetching security configuration from Keycloak...")
     # Get Keycloak's configuration (tells us where to find the public keys)
-    oidc = c.get(f"{REALM_URL}/.well-known/openid-configuration").json()
+    resp = await client.get(f"{REALM_URL}/.well-known/openid-configuration")
+    resp.raise_for_status()
+    jwks_uri = resp.json()["jwks_uri"]
     # Get the actual public keys that we'll use to verify JWT signatures
-    jwks = c.get(oidc["jwks_uri"]).json()
-print("Security configuration loaded successfully")
+    resp = await client.get(jwks_uri)
+    resp.raise_for_status()
+    print("Security configuration loaded successfully")
+    return {
+        "jwks_uri": jwks_uri,
+        "jwks": resp.json(),
+        "cache_control": resp.headers.get("cache-control"),
+        "etag": resp.headers.get("etag"),
+    }
 
-def _find_key(header):
+def _read_shared_security_config():
     """
-    Helper function to find the correct public key for verifying a JWT token.
-    Each JWT token has a 'kid' (key ID) in its header that tells us which public key to use.
+    Helper function that reads the keys another worker saved, if they're recent enough.
+    Returns None if there's no usable file.
     """
-    kid = header.get("kid")  # Get the key ID from the token header
-    # Look through all available public keys to find the one with matching ID
-    for k in jwks.get("keys", []):
-        if k.get("kid") == kid:
-            return k
-    return None  # No matching key found
+    try:
+        if time.time() - os.path.getmtime(JWKS_CACHE_FILE) > JWKS_CACHE_FILE_MAX_AGE:
+            return None
+        with open(JWKS_CACHE_FILE, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def _write_shared_security_config(config: dict):
+    """
+    Helper function that saves the keys for other workers. Writes to a temporary file
+    first, so nobody ever reads a half-written file.
+    """
+    tmp_path = f"{JWKS_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(config))
+        os.replace(tmp_path, JWKS_CACHE_FILE)
+    except OSError as e:
+        print(f"Could not share Keycloak keys with other workers: {e}")
+
+async def _load_security_config(client: httpx.AsyncClient) -> dict:
+    """
+    Gets Keycloak's keys on startup, making sure only one worker fetches them when
+    JWKS_CACHE_FILE is set. The worker that grabs the lock file fetches and saves the
+    keys; the others wait for the saved file instead of going to Keycloak too.
+    """
+    if not JWKS_CACHE_FILE:
+        return await _fetch_security_config(client)
+
+    config = _read_shared_security_config()
+    if config is not None:
+        return config
+
+    lock_path = f"{JWKS_CACHE_FILE}.lock"
+    deadline = time.time() + JWKS_CACHE_LOCK_TIMEOUT
+    while True:
+        try:
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break  # We got the lock - we're the one who fetches
+        except FileExistsError:
+            pass
+        except OSError:
+            # Can't use the lock file at all - just fetch the keys ourselves
+            return await _fetch_security_config(client)
+
+        # Another worker is fetching - wait for its result
+        await asyncio.sleep(0.1)
+        config = _read_shared_security_config()
+        if config is not None:
+            return config
+        if time.time() > deadline:
+            # The other worker is taking too long (or crashed) - fetch the keys ourselves
+            # and clear its lock so the next startup isn't held up by it
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+            return await _fetch_security_config(client)
+
+    try:
+        config = await _fetch_security_config(client)
+        _write_shared_security_config(config)
+        return config
+    finally:
+        os.close(lock_fd)
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+async def _refresh_jwks_periodically(client: httpx.AsyncClient):
+    """
+    Background task that refreshes Keycloak's keys whenever Keycloak says they get stale,
+    so rotated keys are usually already known before the first token using them arrives.
+    """
+    while True:
+        await asyncio.sleep(max(jwks_cache.refresh_after - time.time(), JWKS_MIN_REFRESH_INTERVAL))
+        try:
+            await jwks_cache.refresh(client)
+        except _JWKS_REFRESH_ERRORS as e:
+            # Keep using the keys we already have - we'll try again next time
+            print(f"Failed to refresh Keycloak keys: {e!r}")
 
-def verify_bearer(token: str):
+# ---- Verified Token Cache ----
+# Checking a token's RSA signature is the most expensive thing our middleware does.
+# Clients usually send the same token over and over until it expires, so we remember
+# tokens we've already verified for a short time and skip the expensive check next time.
+TOKEN_CACHE_TTL = 60  # Seconds a verified token is trusted without re-checking it
+TOKEN_CLOCK_LEEWAY = 30  # Seconds of clock drift between us and Keycloak we tolerate (exp/iat checks)
+_token_cache = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL)
+_token_cache_lock = threading.Lock()  # TTLCache is not thread-safe on its own
+
+def _token_cache_key(token: str) -> bytes:
+    """
+    Helper function that turns a token into a short, fixed-size cache key.
+    We hash it so the cache doesn't hold on to full bearer tokens.
+    """
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def _read_only(value):
+    """
+    Helper function that makes decoded JSON read-only, all the way down:
+    objects become read-only mappings and lists become tuples.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({k: _read_only(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_read_only(v) for v in value)
+    return value
+
+async def verify_bearer(token: str, client: httpx.AsyncClient):
     """
     This is the core security function that validates JWT tokens.
     It performs several security checks to ensure the token is legitimate.
+    Tokens that were verified recently are served from a short-lived cache.
+    The client is only used if we need to refetch Keycloak's keys.
+
+    Returns a tuple (claims, allows_impersonation, user, email) so the middleware
+    doesn't have to dig through the claims again on every request.
     """
+    # Step 0: If we've already verified this exact token, reuse the result
+    # (as long as the token itself hasn't expired in the meantime)
+    cache_key = _token_cache_key(token)
+    with _token_cache_lock:
+        cached = _token_cache.get(cache_key)
+    if cached is not None:
+        claims, exp, allows_impersonation, user, email = cached
+        if exp > time.time():
+            return claims, allows_impersonation, user, email
+
     # Step 1: Extract the token header (without verifying signature yet)
-    header = jwt.get_unverified_header(token)
+    # A JWT looks like "header.payload.signature" - we only need the first part to find the key
+    try:
+        header = orjson.loads(base64.urlsafe_b64decode(token.split(".", 1)[0] + "=="))
+    except ValueError:
+        header = None
+    # The key ID must be a string - anything else can't match a key (and shouldn't trigger a refetch)
+    kid = header.get("kid") if isinstance(header, dict) else None
+    if not isinstance(kid, str):
+        raise HTTPException(status_code=401, detail="Malformed token")
     
     # Step 2: Find the correct public key to verify this token's signature
-    key = _find_key(header)
-    if not key:
+    key = await jwks_cache.get_key(kid, client)
+    if key is None:
         raise HTTPException(status_code=401, detail="Unknown key id (kid)")
 
     # Step 3: Verify the token's signature and validate its claims
-    # This is where the magic happens - we verify the token was actually issued by Keycloak
-    claims = jwt.decode(
-        token,
-        key,  # The public key to verify the signature
-        algorithms=[key.get("alg", "RS256")],  # The encryption algorithm used
-        audience=AUDIENCE,  # Verify the token was issued for our specific client
-        options={"verify_at_hash": False},  # Skip some checks that aren't needed for client credentials
-    )
+    # This is where the magic happens - we verify the token was actually issued by Keycloak.
+    # PyJWT also checks the issuer for us, so only tokens from our Keycloak realm get through.
+    try:
+        claims = jwt.decode(
+            token,
+            key,  # The public key to verify the signature
+            algorithms=["RS256"],  # The encryption algorithm Keycloak signs tokens with
+            leeway=TOKEN_CLOCK_LEEWAY,  # Don't reject fresh tokens just because our clock is a bit behind
+            audience=AUDIENCE,  # Verify the token was issued for our specific client
+            issuer=REALM_URL,  # Verify the token was issued by our trusted Keycloak server
+            # Run exactly the checks we need, and reject tokens that are missing any of these claims
+            options={
+                "require": ["exp", "iat", "aud", "iss"],
+                "verify_signature": True,
+                "verify_aud": True,
+                "verify_iss": True,
+            },
+        )
+    except jwt.PyJWTError as e:
+        # Expired, wrong audience/issuer, bad signature, ... - all mean "not allowed in"
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
+
+    # The claims are cached and shared by every request carrying this token,
+    # so hand out a read-only copy that no request can change for the others
+    claims = _read_only(claims)
+
+    # Step 4: Work out who the caller is and whether they may impersonate other users
+    # Check if the authenticated user has permission to impersonate other users
+    roles = frozenset((claims.get("realm_access") or {}).get("roles") or ())
+    allows_impersonation = "can_impersonate" in roles
+    # Get the user identity from the token (the actual authenticated user)
+    user  = claims.get("preferred_username") or claims.get("sub")
+    email = claims.get("email")
 
-    # Step 4: Verify the token was issued by our trusted Keycloak server
-    if claims.get("iss") != REALM_URL:
-        raise HTTPException(status_code=401, detail="Bad issuer")
+    # Step 5: Remember this token so repeat requests skip the checks above
+    # Tokens without an expiry are never cached - we couldn't tell when to stop trusting them
+    exp = claims.get("exp")
+    if isinstance(exp, (int, float)):
+        with _token_cache_lock:
+            _token_cache[cache_key] = (claims, exp, allows_impersonation, user, email)
     
     # If we get here, the token is valid! Return the user's information
-    return claims
+    return claims, allows_impersonation, user, email
 
 # ---- Create the Agent Application ----
 # This creates the basic agent app using Google's ADK (Agent Development Kit)
 # The agent is defined in wayfarer-agent/agent.py and exports 'root_agent'
-adk_app: FastAPI = get_fast_api_app(agents_dir=".", web=True)
+# Importing ADK is slow (it pulls in google-genai, protobuf, grpc, ...), so instead of
+# doing it when this file is imported, we do it during startup while Keycloak's keys load.
+def _import_adk():
+    """
+    Helper function that imports ADK's app factory. Runs in a worker thread on startup.
+    """
+    from google.adk.cli.fast_api import get_fast_api_app
+    return get_fast_api_app
+
+def _build_adk_app(get_fast_api_app) -> FastAPI:
+    """
+    Helper function that creates the agent app once ADK has been imported.
+    """
+    return get_fast_api_app(agents_dir=".", web=True)
 
 # ---- Create Our Secure Application Wrapper ----
 # We create our own FastAPI app that will wrap the agent app with security
 # This allows us to add authentication before requests reach the agent
 app = FastAPI(title="Secure Agent API", description="Agent protected with JWT authentication")
 
+# ---- Shared HTTP Client, Key Loading and Background Key Refresh ----
+# All calls to Keycloak go through one shared async HTTP client, so they never block
+# the event loop and reuse open connections. On startup we load Keycloak's keys and
+# start refreshing them in the background, and clean everything up on shutdown.
+@app.on_event("startup")
+async def startup():
+    app.state.http_client = httpx.AsyncClient(
+        timeout=5.0,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+    )
+    # Import ADK in a background thread while we wait on Keycloak for the keys
+    get_fast_api_app, _ = await asyncio.gather(
+        asyncio.to_thread(_import_adk),
+        jwks_cache.load(app.state.http_client),
+    )
+    # Mount the agent application - this connects our secure wrapper to the actual agent
+    # All requests to the agent will now go through our authentication middleware first
+    if getattr(app.state, "adk_app", None) is None:
+        app.state.adk_app = _build_adk_app(get_fast_api_app)
+        app.mount("/", app.state.adk_app)
+    app.state.jwks_refresher = asyncio.create_task(_refresh_jwks_periodically(app.state.http_client))
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.jwks_refresher.cancel()
+    await app.state.http_client.aclose()
+
+# ---- Authenticated Actor ----
+@dataclass(slots=True, frozen=True)
+class Actor:
+    """
+    Who a request is acting as, stored on request.state.actor by the middleware.
+    """
+    user: str | None
+    email: str | None
+    claims: Mapping[str, Any]  # Keep claims if you want to forward token-derived context
+
+    def __post_init__(self):
+        # The claims may be shared with other requests using the same token, so they must be
+        # read-only too (verify_bearer already hands out a read-only view - this covers any other caller)
+        if not isinstance(self.claims, MappingProxyType):
+            object.__setattr__(self, "claims", _read_only(self.claims))
+
+# ---- Public Paths ----
+# Requests for these paths skip authentication entirely: the health check, FastAPI's docs,
+# and the static files (HTML/JS/CSS) of ADK's web UI.
+# Checking a token on every asset load would only waste time verifying signatures.
+# Prefixes end with "/" so they only match whole path segments - "/statistics" or
+# "/dev-uiX" must still need a token.
+PUBLIC_PATHS = frozenset({"/healthz", "/docs", "/openapi.json", "/dev-ui"})
+PUBLIC_PATH_PREFIXES = ("/static/", "/assets/", "/dev-ui/")
+
 @app.middleware("http")
 async def auth_and_headers(request: Request, call_next):
     """
@@ -89,42 +456,41 @@ async def auth_and_headers(request: Request, call_next):
     It's like a security guard that checks everyone before they can enter.
     """
     
-    # Allow public access to health check endpoint (no authentication required)
-    if request.url.path.startswith("/healthz"):
+    # Allow public access to the health check, API docs and the web UI's static files,
+    # plus CORS preflight (OPTIONS) requests - none of these need a token
+    path = request.url.path
+    if request.method == "OPTIONS" or path in PUBLIC_PATHS or path.startswith(PUBLIC_PATH_PREFIXES):
         return await call_next(request)
 
     # For all other endpoints, require a valid JWT token
-    # Look for the Authorization header (case-insensitive)
-    auth = request.headers.get("authorization") or request.headers.get("Authorization")
+    # Look for the Authorization header (Starlette header lookups are already case-insensitive)
+    auth = request.headers.get("authorization")
     
-    # Check if the header exists and starts with "Bearer " (the standard format)
-    if not auth or not auth.lower().startswith("bearer "):
-        return JSONResponse({"detail": "Missing bearer token"}, status_code=401)
+    # Split the header into its scheme ("Bearer") and the token part in one go
+    scheme, sep, token = (auth or "").partition(" ")
+    token = token.strip()
 
-    # Extract just the token part (remove "Bearer " prefix)
-    token = auth.split(" ", 1)[1].strip()
+    # Check if the header exists and looks like "Bearer <token>" (the standard format)
+    if not sep or scheme.lower() != "bearer" or not token:
+        return JSONResponse({"detail": "Missing bearer token"}, status_code=401)
 
     # Verify the token is valid and get user information from it
     try:
-        claims = verify_bearer(token)
+        claims, allows_impersonation, actor_user_from_token, actor_email_from_token = await verify_bearer(
+            token, request.app.state.http_client
+        )
     except HTTPException as e:
         # If token verification fails, return an error
         return JSONResponse({"detail": e.detail}, status_code=e.status_code)
 
     # ---- Role-Based Impersonation Security ----
-    # Check if the authenticated user has permission to impersonate other users
-    roles = (claims.get("realm_access", {}) or {}).get("roles", []) or []
-    allows_impersonation = "can_impersonate" in roles
-
-    # Get the user identity from the token (the actual authenticated user)
-    actor_user_from_token  = claims.get("preferred_username") or claims.get("sub")
-    actor_email_from_token = claims.get("email")
-
+    # verify_bearer already told us who the token belongs to and whether the
+    # caller has the 'can_impersonate' role
     if allows_impersonation:
         # User has impersonation rights - they can set X-Actor-User/X-Actor-Email headers
         # to act on behalf of another user (useful for admin/support scenarios)
-        actor_user  = request.headers.get("X-Actor-User")  or actor_user_from_token
-        actor_email = request.headers.get("X-Actor-Email") or actor_email_from_token
+        actor_user  = request.headers.get("x-actor-user")  or actor_user_from_token
+        actor_email = request.headers.get("x-actor-email") or actor_email_from_token
     else:
         # User cannot impersonate - ignore any custom headers and use only token identity
         # This prevents regular users from spoofing other users' identities
@@ -132,11 +498,8 @@ async def auth_and_headers(request: Request, call_next):
         actor_email = actor_email_from_token
 
     # Store the final user information in the request so the agent can access it
-    request.state.actor = {
-        "user": actor_user,
-        "email": actor_email,
-        "claims": claims,   # Keep claims if you want to forward token-derived context
-    }
+    # (read it as request.state.actor.user, .email and .claims)
+    request.state.actor = Actor(actor_user, actor_email, claims)
 
     # If we get here, authentication was successful - allow the request to continue
     return await call_next(request)
@@ -151,8 +514,3 @@ def healthz():
     This is typically used by load balancers and monitoring systems.
     """
     return {"ok": True}
-
-# ---- Mount the Agent Application ----
-# This connects our secure wrapper to the actual agent application
-# All requests to the agent will now go through our authentication middleware first
-app.mount("/", adk_app)
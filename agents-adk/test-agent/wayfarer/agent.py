@@ -1,5 +1,10 @@
+import datetime
+from weakref import WeakKeyDictionary
+from zoneinfo import ZoneInfo  # Python's timezone library
+
 from google.adk.agents import Agent
 from google.adk.tools.mcp_tool.mcp_toolset import MCPToolset, StdioServerParameters, StdioConnectionParams
+from pydantic import BaseModel
 
 # # Security Callback Function (Currently Disabled)
 # This is an example of how you could add additional security validation
@@ -28,6 +33,13 @@ from google.adk.tools.mcp_tool.mcp_toolset import MCPToolset, StdioServerParamet
 #   print("✅ Security validation passed.")
 #   return None
 
+# ---- Supported Cities ----
+# Timezones the get_current_time tool knows about, built once when the agent loads
+# (keys are lowercase city names, values use standard timezone identifiers)
+_TZ_BY_CITY = {
+    "new york": ZoneInfo("America/New_York"),
+}
+
 def get_current_time(city: str) -> dict:
     """
     Tool function that returns the current time in a specified city.
@@ -41,14 +53,10 @@ def get_current_time(city: str) -> dict:
             - status: "success" and report: time information, OR
             - status: "error" and error_message: explanation of what went wrong
     """
-    import datetime
-    from zoneinfo import ZoneInfo  # Python's timezone library
-
     # For this example, we only support New York timezone
     # In a real application, you might support many more cities
-    if city.lower() == "new york":
-        tz_identifier = "America/New_York"  # Standard timezone identifier
-    else:
+    tz = _TZ_BY_CITY.get(city.lower())
+    if tz is None:
         # Return an error if we don't support the requested city
         return {
             "status": "error",
@@ -56,7 +64,6 @@ def get_current_time(city: str) -> dict:
         }
 
     # Get the current time in the specified timezone
-    tz = ZoneInfo(tz_identifier)
     now = datetime.datetime.now(tz)
     
     # Format the time nicely and return success response
@@ -65,6 +72,42 @@ def get_current_time(city: str) -> dict:
         "report": f"The current time in {city} is {now.strftime('%Y-%m-%d %H:%M:%S %Z%z')}"
     }
 
+# ---- Session State Converters ----
+# How to turn the different kinds of session state objects into a plain dict.
+# Converters are looked up by type (walking its class hierarchy) and the choice is
+# remembered per type, so the tool doesn't probe the state's attributes on every call.
+_STATE_CONVERTERS = {
+    BaseModel: lambda s: s.model_dump(),  # Pydantic models
+    dict: dict,                           # Plain dicts (copied)
+}
+_converter_by_type = WeakKeyDictionary()  # Converter chosen for each state type seen so far
+
+def _fallback_state_converter(state):
+    """
+    Picks a converter for a state type that has no registered converter.
+    """
+    if hasattr(state, '__dict__'):
+        # If it has __dict__, use that
+        return lambda s: s.__dict__.copy()
+    if hasattr(state, '__iter__'):
+        # Try to convert to dict directly
+        return dict
+    return lambda s: {}
+
+def _state_to_dict(state) -> dict:
+    """
+    Converts a session state object to a dict using the converter for its type.
+    """
+    state_type = type(state)
+    converter = _converter_by_type.get(state_type)
+    if converter is None:
+        converter = next(
+            (_STATE_CONVERTERS[cls] for cls in state_type.__mro__ if cls in _STATE_CONVERTERS),
+            None,
+        ) or _fallback_state_converter(state)
+        _converter_by_type[state_type] = converter
+    return converter(state)
+
 def my_session_state_test_tool(tool_context) -> dict:
     """
     Tool function that returns the current session state information.
@@ -81,21 +124,9 @@ def my_session_state_test_tool(tool_context) -> dict:
             - state: The current session state data
     """
     try:
-        # Extract session state from tool context
-        # Handle different types of tool_context objects
-        if hasattr(tool_context, 'state'):
-            # Convert ADK State object to a serializable dict
-            if hasattr(tool_context.state, 'model_dump'):
-                # If it's a Pydantic model, convert to dict
-                session_state = tool_context.state.model_dump()
-            elif hasattr(tool_context.state, '__dict__'):
-                # If it has __dict__, use that
-                session_state = tool_context.state.__dict__.copy()
-            else:
-                # Try to convert to dict directly
-                session_state = dict(tool_context.state) if hasattr(tool_context.state, '__iter__') else {}
-        else:
-            session_state = {}
+        # Extract session state from tool context and convert it to a serializable dict
+        # (tool contexts without a state end up as an empty dict)
+        session_state = _state_to_dict(getattr(tool_context, 'state', None))
         
         # Handle nested state structure (state.state)
         if 'state' in session_state and isinstance(session_state['state'], dict):